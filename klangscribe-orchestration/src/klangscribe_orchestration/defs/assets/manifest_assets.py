@@ -1,8 +1,8 @@
 import os
 import io
-import re
 import json
 import time
+import tempfile
 import traceback
 from ...utils.audio_processing import opus_to_wav_bytes, merge_wav_bytes, merge_opus_bytes
 from ...utils.raw_processing import (
@@ -10,14 +10,16 @@ from ...utils.raw_processing import (
     convert_notes_to_seconds, calculate_note_density_summary, convert_notes_to_fixed_grid
 )
 from dataclasses import dataclass, asdict
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
 
 import dagster as dg
 import numpy as np
+import orjson
 import polars as pl
 import pyarrow as pa
+import pyarrow.parquet as pq
 from psycopg2 import sql
 from ..resources import PostgresResource, S3Resource
 
@@ -37,55 +39,42 @@ REQUIRED_EXTS = AUDIO_EXTS + CHART_EXTS + INI_EXTS
 #### Helpers ####
 
 
-def _lname(f: Dict[str, Any]) -> str:
-    return str(f.get("filename", "")).strip().lower()
+# Schema of a single file record in `directory_metadata.files_json`
+_FILE_RECORD = pl.Struct({"filename": pl.Utf8, "storage_path": pl.Utf8, "file_size": pl.Int64})
 
+# "s3://uns/<uuid>" prefix found on older `storage_path` values
+_S3_UUID_PREFIX_PATTERN = r'^s3://uns/[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}'
 
-def _filter_required(files: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-    return [f for f in files if _lname(f).endswith(REQUIRED_EXTS)]
 
-
-def _remove_s3_uuid_prefix(storage_path) -> str:
+def _remove_s3_uuid_prefix(storage_path: pl.Expr) -> pl.Expr:
     """
     Removes the "s3://uns/<uuid>" prefix of a storage path.
     """
-    s3_uuid_prefix_pattern = r'^s3://uns/[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}'
-    return re.sub(s3_uuid_prefix_pattern, '', storage_path).strip()
+    return storage_path.str.replace(_S3_UUID_PREFIX_PATTERN, '').str.strip_chars()
 
 
-def _pick_single_storage_path(files: List[Dict[str, Any]], ext: str) -> Optional[str]:
+def _pick_single_storage_path(exts: Tuple[str, ...]) -> pl.Expr:
     """
     Returns a storage path for .chart and .ini which should be singletons,
     but if multple exist, choose deterministically (largest file_size, then filename).
+    Expects files to be sorted by (file_size, lname) descending.
     """
-    candidates = [f for f in files if _lname(f).endswith(ext)]
-    if not candidates:
-        return None
-    candidates.sort(key=lambda x: (int(x.get("file_size", 0) or 0), _lname(x)), reverse=True)
-    storage_path = str(candidates[0].get("storage_path"))
-    return _remove_s3_uuid_prefix(storage_path)
-
-
-def _sorted_opus_paths(files: List[Dict[str, Any]]) ->List[str]:
-    opus = [f for f in files if _lname(f).endswith(".opus")]
-    opus.sort(key=lambda x: (_lname(x), str(x.get("storage_path", ""))))
-    storage_paths = [str(f.get("storage_path")) for f in opus if f.get("storage_path")]
-    return [_remove_s3_uuid_prefix(sp) for sp in storage_paths]
+    return pl.col("storage_path").filter(pl.col("ext").is_in(exts)).first()
 
 
-def _collect_valid_songs(result_rows: list) -> Tuple[List[Dict[str, Any]], Dict[str, int]]:
+def _collect_valid_songs(result_rows: list) -> Tuple[pl.DataFrame, Dict[str, int]]:
     """
     Iterates through song records in `directory_metadata` table from KlangScribe PostgreSQL database,
     keeping only songs which contain required files (e.g., .ini/.chart/.opus files).
     
     Returns:
-        - rows dictionary with schema:
+        - rows DataFrame with schema:
         {
-            "dir_id": int,              # ID of the song in Postgres
+            "dir_id": str,              # ID of the song in Postgres
             "dirname": str,             # Name of the song directory stored in S3
             "ini_path": str,            # S3 bucket/key string to a single expected .ini file (containing song metadata)
             "chart_path": str,          # S3 bucket/key string to a single expected .chart file (containing song note sequence info)
-            "opus_paths": List[str],    # List of S3 bucket/key strings to 1+ .opus files (containing song audio)
+            "opus_paths": str,          # JSON list of S3 bucket/key strings to 1+ .opus files (containing song audio)
             "uploaded_at": str          # UTC datetime string of when the song was stored into S3
         }
 
@@ -96,47 +85,107 @@ def _collect_valid_songs(result_rows: list) -> Tuple[List[Dict[str, Any]], Dict[
             "dropped_missing": int      # Number of sings dropped due to missing necessary files
         }
     """
-    rows: List[Dict[str, Any]] = []
+    dirs = pl.DataFrame(
+        [(dir_id, dirname, files_json or [], uploaded_at) for dir_id, dirname, _, _, files_json, uploaded_at in result_rows],
+        schema={
+            "dir_id": pl.Int64,
+            "dirname": pl.Utf8,
+            "files_json": pl.List(_FILE_RECORD),
+            "uploaded_at": pl.Datetime,
+        },
+        orient="row",
+        strict=False,
+    )
 
-    total_songs: int = 0
-    kept_dirs: int = 0
-    dropped_missing: int = 0
+    # one row per file, keeping only the required file types
+    files = (
+        dirs.select("dir_id", "files_json")
+        .explode("files_json")
+        .unnest("files_json")
+        .with_columns(
+            lname=pl.col("filename").fill_null("").str.strip_chars().str.to_lowercase(),
+            storage_path=_remove_s3_uuid_prefix(pl.col("storage_path").fill_null("")),
+            file_size=pl.col("file_size").fill_null(0),
+        )
+        .with_columns(ext=pl.col("lname").str.extract(r"(\.[^.]*)$"))
+        .filter(pl.col("ext").is_in(REQUIRED_EXTS))
+    )
 
-    # iterate through songs (rows)
-    for dir_id, dirname, _, _, files_json, uploaded_at in result_rows:
-        total_songs += 1
-    
-        files: List[str] = _filter_required(files_json)
-        opus_paths = _sorted_opus_paths(files)
-        chart_path = _pick_single_storage_path(files, ".chart")
-        ini_path = _pick_single_storage_path(files, ".ini")
-
-        if not opus_paths or not chart_path or not ini_path:
-            dropped_missing += 1
-            continue
-
-        kept_dirs += 1
-        rows.append(
-            {
-                "dir_id": dir_id,
-                "dirname": dirname,
-                "ini_path": ini_path,
-                "chart_path": chart_path,
-                "opus_paths": json.dumps(opus_paths),
-                "uploaded_at": uploaded_at.strftime("%Y-%m-%d %H:%M:%S")
-            }
+    opus = (
+        files.filter(pl.col("ext").is_in(AUDIO_EXTS) & (pl.col("storage_path") != ""))
+        .sort("lname", "storage_path", maintain_order=True)
+        .group_by("dir_id")
+        .agg(opus_paths=pl.col("storage_path"))
+    )
+    singletons = (
+        files.sort("file_size", "lname", descending=True, maintain_order=True)
+        .group_by("dir_id")
+        .agg(
+            chart_path=_pick_single_storage_path(CHART_EXTS),
+            ini_path=_pick_single_storage_path(INI_EXTS),
         )
-    
+        .filter((pl.col("chart_path").fill_null("") != "") & (pl.col("ini_path").fill_null("") != ""))
+    )
+
+    # keep manifest order (order of `result_rows`)
+    rows = (
+        dirs.select("dir_id", "dirname", "uploaded_at")
+        .join(opus, on="dir_id", how="inner", maintain_order="left")
+        .join(singletons, on="dir_id", how="inner", maintain_order="left")
+    )
+    rows = rows.select(
+        pl.col("dir_id").cast(pl.Utf8),
+        "dirname",
+        "ini_path",
+        "chart_path",
+        pl.Series("opus_paths", [orjson.dumps(paths).decode() for paths in rows["opus_paths"].to_list()], dtype=pl.Utf8),
+        pl.col("uploaded_at").dt.strftime("%Y-%m-%d %H:%M:%S"),
+    )
+
+    total_songs = dirs.height
+    kept_dirs = rows.height
     metadata={
         "total_songs": total_songs,
         "kept_dirs": kept_dirs,
-        "dropped_missing": dropped_missing
+        "dropped_missing": total_songs - kept_dirs
     }
 
     return rows, metadata
 
 
-def _store_manifest_parquet_to_s3(s3: S3Resource, rows: List[Dict[str, Any]], run_id: str) -> Tuple[str, str]:
+def _collect_valid_song_batches(result_batches: Iterable[list], counts: Dict[str, int]) -> Iterator[pl.DataFrame]:
+    """Runs `_collect_valid_songs` on a worker thread per batch, summing batch metadata into `counts`"""
+    def finish(future) -> pl.DataFrame:
+        batch, metadata = future.result()
+        for name, value in metadata.items():
+            counts[name] += value
+        return batch
+
+    with ThreadPoolExecutor(max_workers=1) as ex:
+        pending = None
+        for result_rows in result_batches:
+            future = ex.submit(_collect_valid_songs, result_rows)
+            if pending is not None:
+                yield finish(pending)
+            pending = future
+
+        if pending is not None:
+            yield finish(pending)
+
+
+# Manifest parquet schema (see `_collect_valid_songs`)
+_MANIFEST_SCHEMA = pa.schema(
+    [(name, pa.string()) for name in ("dir_id", "dirname", "ini_path", "chart_path", "opus_paths", "uploaded_at")]
+)
+
+# Only low-cardinality columns are dictionary-encoded
+_MANIFEST_DICTIONARY_COLUMNS = ["uploaded_at"]
+
+# Manifest bytes kept in memory before spilling to a temp file on disk
+_MANIFEST_SPOOL_MAX_SIZE = 64 * 1024 * 1024
+
+
+def _store_manifest_parquet_to_s3(s3: S3Resource, batches: Iterable[pl.DataFrame], run_id: str) -> Tuple[str, str]:
     """
     Writes validated song records to a collected songs manifest .parquet file and stores in s3,
     using (bucket='data-collection', prefix='manifests').
@@ -145,31 +194,32 @@ def _store_manifest_parquet_to_s3(s3: S3Resource, rows: List[Dict[str, Any]], ru
         - String of the bucket name where the manifest was stored
         - String of the object key where the manifest was stored
     """
-    
-    # Build Polars DataFrame
-    df = pl.DataFrame(rows, schema={
-        "dir_id": pl.Utf8,
-        "dirname": pl.Utf8,
-        "ini_path": pl.Utf8,
-        "chart_path": pl.Utf8,
-        "opus_paths": pl.Utf8,
-        "uploaded_at": pl.Utf8,
-    })
-
-    # Write parquet to bytes (S3 resource handles storage)
-    buf = io.BytesIO()
-    df.write_parquet(buf, compression="zstd")
-    data = buf.getvalue()
-
 
     manifest_name = f"manifest_{run_id}.parquet"
     bucket = 'data-collection'
     manifest_key = f"manifests/{manifest_name}"
-    s3.put_bytes(bucket_name=bucket, obj_key=manifest_key, data=data, content_type="application/octet-stream")
+
+    with tempfile.SpooledTemporaryFile(max_size=_MANIFEST_SPOOL_MAX_SIZE) as buf:
+        # Write parquet batch by batch (S3 resource handles storage)
+        with pq.ParquetWriter(
+            buf, _MANIFEST_SCHEMA, compression="zstd", use_dictionary=_MANIFEST_DICTIONARY_COLUMNS
+        ) as writer:
+            for batch in batches:
+                writer.write_table(batch.to_arrow().cast(_MANIFEST_SCHEMA))
+
+        buf.seek(0)
+        s3.put_large_object(bucket_name=bucket, obj_key=manifest_key, fileobj=buf, content_type="application/octet-stream")
 
     return bucket, manifest_key
 
 
+# Server-side required-files check; directories failing it come back with a NULL `files_json`
+_HAS_REQUIRED_FILES_SQL = " AND ".join(
+    f"EXISTS (SELECT 1 FROM jsonb_array_elements(files_json) f WHERE lower(trim(f->>'filename')) LIKE '%{ext}')"
+    for ext in REQUIRED_EXTS
+)
+
+
 #### Asset Definition ####
 
 
@@ -198,13 +248,12 @@ def raw_manifest_parquet(
                 dirname AS dirname,
                 file_count AS file_count,
                 total_size AS total_size,
-                files_json AS files_json, 
+                CASE WHEN {has_required_files} THEN files_json END AS files_json,
                 uploaded_at AS uploaded_at
             FROM
                 directory_metadata
-        """
-        # list of songs from data collection metadata table
-        result_rows = pg.fetchall(query)
+        """.format(has_required_files=_HAS_REQUIRED_FILES_SQL)
+        params = {}
     else:
         context.log.info("Running in TEST mode: processing only a subset of songs from PostgreSQL (for faster iteration during development)")
         query: str = """
@@ -213,34 +262,32 @@ def raw_manifest_parquet(
                 dirname AS dirname,
                 file_count AS file_count,
                 total_size AS total_size,
-                files_json AS files_json, 
+                CASE WHEN {has_required_files} THEN files_json END AS files_json,
                 uploaded_at AS uploaded_at
             FROM
                 directory_metadata
             LIMIT
                 :limit
-        """
+        """.format(has_required_files=_HAS_REQUIRED_FILES_SQL)
         try:
             limit = int(os.getenv("DATA_LIMIT", "10"))
         except ValueError:
             context.log.warning(f"Invalid DATA_LIMIT value: {os.getenv('DATA_LIMIT')}, defaulting to 10")
             limit = 10
         params = {'limit': limit}
-        # list of songs from data collection metadata table
-        result_rows = pg.fetchall(query, params)
-
-    # Filter song records missing the proper files
-    rows, metadata = _collect_valid_songs(result_rows)
 
-    total_songs = metadata["total_songs"]
-    kept_dirs = metadata["kept_dirs"]
-    dropped_missing = metadata["dropped_missing"]
-
-    context.log.info(f"Manifest: total={total_songs} kept={kept_dirs} dropped_missing={dropped_missing}")
+    # Stream songs from data collection metadata table, filtering song records missing the proper files batch by batch
+    counts = {"total_songs": 0, "kept_dirs": 0, "dropped_missing": 0}
+    batches = _collect_valid_song_batches(pg.iter_query(query, params), counts)
 
     # Store valid song data as a manifest parquet to s3
-    bucket, manifest_key = _store_manifest_parquet_to_s3(s3, rows, context.run_id)
+    bucket, manifest_key = _store_manifest_parquet_to_s3(s3, batches, context.run_id)
 
+    total_songs = counts["total_songs"]
+    kept_dirs = counts["kept_dirs"]
+    dropped_missing = counts["dropped_missing"]
+
+    context.log.info(f"Manifest: total={total_songs} kept={kept_dirs} dropped_missing={dropped_missing}")
     context.log.info(f"Manifest stored to bucket={bucket} with key={manifest_key}")
 
     return dg.MaterializeResult(
@@ -1,9 +1,12 @@
 import os
+import time
 import shutil
+from concurrent.futures import ThreadPoolExecutor
 
 import dagster as dg
 
 from ..resources import S3Resource, DirectoryProcessingResource
+from ..resources.s3 import _UPLOAD_CONCURRENCY
 
 class DirConfig(dg.Config):
     """Configuration for file processing job."""
@@ -26,65 +29,60 @@ def process_directory(
     context.log.info(f"Processing directory: {dirname} at {dirpath}")
 
     try:
-        # Get all files in directory
-        files = [
-            f for f in os.listdir(dirpath)
-            if os.path.isfile(os.path.join(dirpath, f))
-        ]
-
-        context.log.info(f"Found {len(files)} files in {dirname}")
-
-        uploaded_files = []
-        total_size = 0
-
-        # Upload each file in the directory
-        for filename in files:
+        # Get all files in directory with their sizes. scandir answers is_file() from the
+        # directory entry type and caches the one stat() needed for the size.
+        # File records are kept as parallel lists (index i describes one file) rather than a dict per file
+        filenames, file_sizes = [], []
+        with os.scandir(dirpath) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    filenames.append(entry.name)
+                    file_sizes.append(entry.stat().st_size)
+
+        context.log.info(f"Found {len(filenames)} files in {dirname}")
+
+        bucket_name = "data-collection"
+        key_prefix = f"collected/{dirname}/"
+
+        # Per-file logs stay at debug level: every log call is a Dagster event log write
+        def upload(filename: str, file_size: int) -> str:
             filepath = os.path.join(dirpath, filename)
-            file_size = os.path.getsize(filepath)
-
-            context.log.info(f"  Uploading: {filename} ({file_size} bytes)")
-
-            bucket_name = "data-collection"
-            object_key = f"collected/{dirname}/{filename}"
-
-            context.log.info(f"    Bucket:     {bucket_name}")
-            context.log.info(f"    Object Key: {object_key}")
-            context.log.info(f"    Filepath:   {filepath}")
-
-            context.log.info(f"S3_ENDPOINT_URL: {s3.endpoint}")
-            context.log.info(f"S3_ACCESS_KEY: {s3.access_key}")
-            context.log.info(f"S3_SECRET_KEY: {s3.secret_key}")
-            context.log.info(f"S3_REGION: {s3.region}")
+            object_key = key_prefix + filename
 
             storage_path = s3.upload_file(bucket_name, object_key, filepath)
-            context.log.info(f"  Uploaded to S3: {storage_path}")
+            context.log.debug(f"  Uploaded: {filepath} ({file_size} bytes) -> {storage_path}")
 
-            uploaded_files.append({
-                "filename": filename,
-                "storage_path": storage_path,
-                "file_size": file_size
-            })
+            return storage_path
 
-            total_size += file_size
+        # Upload files concurrently; each upload is network-bound and boto3 releases the GIL
+        # while waiting, so threads sharing the one cached client overlap their round trips
+        upload_start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max(1, min(_UPLOAD_CONCURRENCY, len(filenames)))) as executor:
+            # map keeps `filenames` order and re-raises the first failed upload
+            storage_paths = list(executor.map(upload, filenames, file_sizes))
 
-        # Store metadata in PostgreSQL
-        dir_proc.store_directory_metadata(
-            dirname=dirname,
-            file_count=len(uploaded_files),
-            total_size=total_size,
-            files=uploaded_files
+        total_size = sum(file_sizes)
+        context.log.info(
+            f"Uploaded {len(filenames)} files ({total_size} bytes) to {bucket_name} "
+            f"in {time.perf_counter() - upload_start:.2f}s"
         )
-        context.log.info(f"Stored metadata in PostgreSQL")
 
-        # Mark as completed in processing state table
-        dir_proc.mark_directory_as_completed(dirname)
-        context.log.info(f"Marked directory as completed")
+        # Store metadata and mark as completed in one round trip
+        dir_proc.finish_directory(
+            dirname=dirname,
+            filenames=filenames,
+            storage_paths=storage_paths,
+            file_sizes=file_sizes
+        )
+        context.log.info("Stored metadata in PostgreSQL and marked directory as completed")
 
         return {
             "dirname": dirname,
-            "file_count": len(uploaded_files),
+            "file_count": len(filenames),
             "total_size": total_size,
-            "uploaded_files": uploaded_files
+            "filenames": filenames,
+            "storage_paths": storage_paths,
+            "file_sizes": file_sizes
         }
 
     except Exception as e:
@@ -113,8 +111,8 @@ def send_notification(context: dg.OpExecutionContext, dir_info: dict):
     context.log.info(f"-> Directory processing complete: {dir_info['dirname']}")
     context.log.info(f"   Files processed:               {dir_info['file_count']}")
     context.log.info(f"   Total size:                    {dir_info['total_size']} bytes")
-    for file_info in dir_info['uploaded_files']:
-        context.log.info(f"     - {file_info['filename']}   ->   {file_info['storage_path']} ({file_info['file_size']} bytes)")
+    for filename, storage_path, file_size in zip(dir_info['filenames'], dir_info['storage_paths'], dir_info['file_sizes']):
+        context.log.debug(f"     - {filename}   ->   {storage_path} ({file_size} bytes)")
 
 
 @dg.job
@@ -1,48 +1,155 @@
-import json
-from typing import Optional
+import threading
+from datetime import datetime
+from typing import Collection, Iterable, Iterator, List, Optional, Set, Tuple
 
 import dagster as dg
+import orjson
 from sqlalchemy import text
-from sqlalchemy.exc import IntegrityError
 
 from .postgres import PostgresResource
 
 
+_SCHEMA_DDL = """
+    -- Directory processing state table
+    CREATE TABLE IF NOT EXISTS directory_processing_state (
+        dirname VARCHAR(255) PRIMARY KEY,
+        started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        completed_at TIMESTAMP,
+        status VARCHAR(50) DEFAULT 'processing',
+        run_id VARCHAR(255)
+    );
+
+    -- Directory metadata table
+    CREATE TABLE IF NOT EXISTS directory_metadata (
+        id SERIAL PRIMARY KEY,
+        dirname VARCHAR(255),
+        file_count INTEGER,
+        total_size BIGINT,
+        files_json JSONB,
+        uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+    -- Create index for faster lookups
+    CREATE INDEX IF NOT EXISTS idx_directory_processing_state_status
+    ON directory_processing_state(status);
+
+    -- The keyset (uploaded_at, id) and stuck-directory indexes come from
+    -- local-services/storage/klangscribe-postgres/migrations/001_directory_indexes.sql, built CONCURRENTLY:
+    -- applied on first init of the local postgres container, and by hand elsewhere (see README)
+"""
+
+# (host, port, database) keys whose schema has already been ensured by this process
+_SCHEMA_READY: set = set()
+_SCHEMA_LOCK = threading.Lock()
+
+# Batches larger than this are loaded with COPY rather than a single json_populate_recordset INSERT
+_COPY_THRESHOLD = 100
+
+# Candidate lists longer than this are checked through a COPY-loaded temp table rather than one array parameter
+_STREAMING_LOOKUP_THRESHOLD = 10000
+
+# Hot single-row statements, prepared server-side once per pooled connection so
+# Postgres skips parsing/planning on every directory mark
+_PREPARED_STATEMENTS = {
+    "mark_directory_processing": """
+        INSERT INTO directory_processing_state (dirname, status, run_id)
+        VALUES ($1, 'processing', $2)
+        ON CONFLICT (dirname) DO NOTHING
+    """,
+    "mark_directories_processing": """
+        INSERT INTO directory_processing_state (dirname, status, run_id)
+        SELECT dirname, 'processing', $2 FROM unnest($1::text[]) AS d(dirname)
+        ON CONFLICT (dirname) DO NOTHING
+        RETURNING dirname
+    """,
+    "mark_directory_completed": """
+        UPDATE directory_processing_state
+        SET status = 'completed', completed_at = CURRENT_TIMESTAMP
+        WHERE dirname = $1
+    """,
+    "mark_directory_failed": """
+        UPDATE directory_processing_state
+        SET status = 'failed', completed_at = CURRENT_TIMESTAMP
+        WHERE dirname = $1
+    """,
+    "store_directory_metadata": """
+        INSERT INTO directory_metadata (dirname, file_count, total_size, files_json)
+        VALUES ($1, $2, $3, $4)
+    """,
+    "finish_directory": """
+        WITH stored AS (
+            INSERT INTO directory_metadata (dirname, file_count, total_size, files_json)
+            SELECT
+                $1,
+                COUNT(*),
+                COALESCE(SUM(f.file_size), 0),
+                COALESCE(
+                    jsonb_agg(
+                        jsonb_build_object('filename', f.filename, 'storage_path', f.storage_path, 'file_size', f.file_size)
+                        ORDER BY f.ord
+                    ),
+                    '[]'::jsonb
+                )
+            FROM unnest($2::text[], $3::text[], $4::bigint[]) WITH ORDINALITY AS f(filename, storage_path, file_size, ord)
+        )
+        UPDATE directory_processing_state
+        SET status = 'completed', completed_at = CURRENT_TIMESTAMP
+        WHERE dirname = $1
+    """,
+    "find_unprocessed_directories": """
+        SELECT c.dirname
+        FROM unnest($1::text[]) AS c(dirname)
+        WHERE NOT EXISTS (
+            SELECT 1 FROM directory_processing_state p WHERE p.dirname = c.dirname
+        )
+    """,
+    "get_stuck_directories": """
+        SELECT dirname, started_at, run_id
+        FROM directory_processing_state
+        WHERE status = 'processing'
+        AND started_at < NOW() - ($1::integer * INTERVAL '1 hour')
+    """,
+    "cleanup_stuck_directories": """
+        UPDATE directory_processing_state
+        SET status = 'failed', completed_at = CURRENT_TIMESTAMP
+        WHERE status = 'processing'
+        AND started_at < NOW() - ($1::integer * INTERVAL '1 hour')
+    """,
+}
+
+
 class DirectoryProcessingResource(dg.ConfigurableResource):
     """Resource for directory processing state and metadata operations."""
 
     pg: dg.ResourceDependency[PostgresResource]
 
+    def _schema_key(self) -> Tuple[str, int, str]:
+        return (self.pg.host, self.pg.port, self.pg.database)
+
     def _ensure_tables_exist(self, conn):
-        """Create tables if they don't exist"""
-        # Directory processing state table
-        conn.execute(text("""
-            CREATE TABLE IF NOT EXISTS directory_processing_state (
-                dirname VARCHAR(255) PRIMARY KEY,
-                started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                completed_at TIMESTAMP,
-                status VARCHAR(50) DEFAULT 'processing',
-                run_id VARCHAR(255)
-            )
-        """))
-
-        # Directory metadata table
-        conn.execute(text("""
-            CREATE TABLE IF NOT EXISTS directory_metadata (
-                id SERIAL PRIMARY KEY,
-                dirname VARCHAR(255),
-                file_count INTEGER,
-                total_size BIGINT,
-                files_json JSONB,
-                uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """))
+        """Create tables if they don't exist (once per process and database)"""
+        key = self._schema_key()
+        if key in _SCHEMA_READY:
+            return
+
+        with _SCHEMA_LOCK:
+            if key not in _SCHEMA_READY:
+                # All DDL goes out in a single round trip, committed on its own
+                # so a later rollback in the caller's transaction can't undo it
+                conn.exec_driver_sql(_SCHEMA_DDL)
+                conn.commit()
+                _SCHEMA_READY.add(key)
+
+    def _execute_prepared(self, conn, name: str, *params):
+        """Execute a statement from `_PREPARED_STATEMENTS`, preparing it on first use per connection"""
+        # conn.info lives with the underlying DBAPI connection, so it survives pool checkouts
+        prepared = conn.info.setdefault("prepared_statements", set())
+        if name not in prepared:
+            conn.exec_driver_sql(f"PREPARE {name} AS {_PREPARED_STATEMENTS[name]}")
+            prepared.add(name)
 
-        # Create index for faster lookups
-        conn.execute(text("""
-            CREATE INDEX IF NOT EXISTS idx_directory_processing_state_status
-            ON directory_processing_state(status)
-        """))
+        placeholders = ", ".join(["%s"] * len(params))
+        return conn.exec_driver_sql(f"EXECUTE {name}({placeholders})", params)
 
     def mark_directory_as_processing(self, dirname: str, run_id: Optional[str] = None):
         """
@@ -54,66 +161,93 @@ class DirectoryProcessingResource(dg.ConfigurableResource):
         with self.pg.get_connection() as conn:
             self._ensure_tables_exist(conn)
 
-            try:
-                # Try to insert (fails if the directory already exists)
-                conn.execute(
-                    text("""
-                        INSERT INTO directory_processing_state (dirname, status, run_id)
-                        VALUES (:dirname, 'processing', :run_id)
-                    """),
-                    {"dirname": dirname, "run_id": run_id}
-                )
-                return True
-            except IntegrityError:
-                # Directory already being processed
-                return False
+            # Inserts nothing if the directory already exists, leaving the transaction clean
+            result = self._execute_prepared(conn, "mark_directory_processing", dirname, run_id)
+            return result.rowcount == 1
+
+    def mark_directories_as_processing(self, dirnames: List[str], run_id: Optional[str] = None) -> Set[str]:
+        """
+        Mark many directories as being processed in one statement.
+        Returns the subset that was successfully marked; directories already present are left untouched,
+        so as with `mark_directory_as_processing`, only returned directories are safe to process.
+        """
+        if not dirnames:
+            return set()
+
+        with self.pg.get_connection() as conn:
+            self._ensure_tables_exist(conn)
+
+            result = self._execute_prepared(conn, "mark_directories_processing", list(dirnames), run_id)
+            return {row[0] for row in result}
 
     def mark_directory_as_completed(self, dirname: str):
         """Mark a directory as completed"""
         with self.pg.get_connection() as conn:
-            conn.execute(
-                text("""
-                    UPDATE directory_processing_state
-                    SET status = 'completed', completed_at = CURRENT_TIMESTAMP
-                    WHERE dirname = :dirname
-                """),
-                {"dirname": dirname}
-            )
+            self._execute_prepared(conn, "mark_directory_completed", dirname)
 
     def mark_directory_as_failed(self, dirname: str):
         """Mark a directory as failed"""
         with self.pg.get_connection() as conn:
-            conn.execute(
-                text("""
-                    UPDATE directory_processing_state
-                    SET status = 'failed', completed_at = CURRENT_TIMESTAMP
-                    WHERE dirname = :dirname
-                """),
-                {"dirname": dirname}
-            )
+            self._execute_prepared(conn, "mark_directory_failed", dirname)
 
-    def get_processed_directories(self) -> set:
+    def get_processed_directories(self) -> frozenset:
         """Get all directories that have been processed or are being processed"""
         with self.pg.get_connection() as conn:
             self._ensure_tables_exist(conn)
 
-            result = conn.execute(text("""SELECT dirname FROM directory_processing_state"""))
-            return {row[0] for row in result.fetchall()}
+            # Stream through a server-side cursor instead of materializing every row first
+            result = conn.execution_options(stream_results=True, yield_per=10000).execute(
+                text("""SELECT dirname FROM directory_processing_state""")
+            )
+            return frozenset(row[0] for row in result)
+
+    def find_unprocessed_directories(self, candidates: Collection[str]) -> Set[str]:
+        """
+        Return the candidates that have never been processed (or queued), filtering in Postgres
+        so only new names come back instead of the whole processing history
+        """
+        if not candidates:
+            return set()
+
+        if len(candidates) > _STREAMING_LOOKUP_THRESHOLD:
+            return self.find_unprocessed_directories_streaming(candidates)
+
+        with self.pg.get_connection() as conn:
+            self._ensure_tables_exist(conn)
+
+            result = self._execute_prepared(conn, "find_unprocessed_directories", list(candidates))
+            return {row[0] for row in result}
+
+    def find_unprocessed_directories_streaming(self, names: Iterable[str]) -> Set[str]:
+        """
+        Same as `find_unprocessed_directories`, for very large candidate sets: names are COPYed into a temp table
+        as they are read from `names`, without building an array parameter, and anti-joined in Postgres
+        """
+        # The lookup runs on a raw cursor, so only the first call per process checks out a
+        # separate connection for the schema DDL
+        if self._schema_key() not in _SCHEMA_READY:
+            with self.pg.get_connection() as conn:
+                self._ensure_tables_exist(conn)
+
+        with self.pg.get_cursor() as cursor:
+            # Dropped when get_cursor commits
+            cursor.execute("CREATE TEMP TABLE unprocessed_candidates (dirname TEXT) ON COMMIT DROP")
+            self.pg.copy_rows(cursor, "unprocessed_candidates", ("dirname",), ((name,) for name in names))
+            cursor.execute("""
+                SELECT c.dirname
+                FROM unprocessed_candidates c
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM directory_processing_state p WHERE p.dirname = c.dirname
+                )
+            """)
+            return {row[0] for row in cursor}
 
     def get_stuck_directories(self, timeout_hours: int = 24) -> list:
         """Get directories stuck in 'processing' state for too long"""
         with self.pg.get_connection() as conn:
             self._ensure_tables_exist(conn)
 
-            result = conn.execute(
-                text("""
-                    SELECT dirname, started_at, run_id
-                    FROM directory_processing_state
-                    WHERE status = 'processing'
-                    AND started_at < NOW() - :timeout_hours * INTERVAL '1 hour'
-                """),
-                {"timeout_hours": timeout_hours}
-            )
+            result = self._execute_prepared(conn, "get_stuck_directories", int(timeout_hours))
             return result.fetchall()
 
     def cleanup_stuck_directories(self, timeout_hours: int = 24) -> int:
@@ -121,15 +255,7 @@ class DirectoryProcessingResource(dg.ConfigurableResource):
         with self.pg.get_connection() as conn:
             self._ensure_tables_exist(conn)
 
-            result = conn.execute(
-                text("""
-                    UPDATE directory_processing_state
-                    SET status = 'failed', completed_at = CURRENT_TIMESTAMP
-                    WHERE status = 'processing'
-                    AND started_at < NOW() - :timeout_hours * INTERVAL '1 hour'
-                """),
-                {"timeout_hours": timeout_hours}
-            )
+            result = self._execute_prepared(conn, "cleanup_stuck_directories", int(timeout_hours))
             return result.rowcount
 
     def store_directory_metadata(self, dirname: str, file_count: int, total_size: int, files: list):
@@ -137,41 +263,105 @@ class DirectoryProcessingResource(dg.ConfigurableResource):
         with self.pg.get_connection() as conn:
             self._ensure_tables_exist(conn)
 
-            conn.execute(
-                text("""
-                    INSERT INTO directory_metadata (dirname, file_count, total_size, files_json)
-                    VALUES (:dirname, :file_count, :total_size, :files_json)
-                """),
-                {"dirname": dirname, "file_count": file_count, "total_size": total_size, "files_json": json.dumps(files)}
-            )
+            self._execute_prepared(conn, "store_directory_metadata", dirname, file_count, total_size, orjson.dumps(files).decode())
+
+    def finish_directory(
+        self,
+        dirname: str,
+        filenames: List[str],
+        storage_paths: List[str],
+        file_sizes: List[int],
+    ):
+        """
+        Store directory metadata and mark the directory as completed in a single statement.
+        Files are given as parallel lists; Postgres builds the `files_json` records and totals from them.
+        """
+        with self.pg.get_connection() as conn:
+            self._ensure_tables_exist(conn)
+
+            self._execute_prepared(conn, "finish_directory", dirname, filenames, storage_paths, file_sizes)
+
+    def store_directory_metadata_batch(self, rows: List[Tuple[str, int, int, list]]):
+        """Store metadata for many directories, given (dirname, file_count, total_size, files) tuples"""
+        if not rows:
+            return
 
-    def get_directory_metadata(self, dirname: Optional[str] = None) -> list:
-        """Retrieve directory metadata from PostgreSQL"""
         with self.pg.get_connection() as conn:
             self._ensure_tables_exist(conn)
 
-            if dirname:
-                # retrieve a specific directory
-                result = conn.execute(
-                    text("""
-                        SELECT id, dirname, file_count, total_size, files_json, uploaded_at
-                        FROM directory_metadata
-                        WHERE dirname = :dirname
-                    """),
-                    {"dirname": dirname}
-                )
-            else:
-                # retrieve all directories
-                result = conn.execute(
-                    text("""
-                        SELECT id, dirname, file_count, total_size, files_json, uploaded_at
-                        FROM directory_metadata
-                        ORDER BY uploaded_at DESC
-                    """)
-                )
+        columns = ("dirname", "file_count", "total_size", "files_json")
+
+        if len(rows) > _COPY_THRESHOLD:
+            # COPY skips per-row parse/plan work, which outweighs its setup cost for large batches
+            values = [(dirname, file_count, total_size, orjson.dumps(files).decode()) for dirname, file_count, total_size, files in rows]
+            self.pg.bulk_copy("directory_metadata", columns, values)
+            return
+
+        # Smaller batches go out as one JSON array; files nest directly into the jsonb column
+        self.pg.bulk_insert_json("directory_metadata", columns, [dict(zip(columns, row)) for row in rows])
+
+    def get_directory_metadata(
+        self,
+        dirname: Optional[str] = None,
+        *,
+        limit: int = 1000,
+        before: Optional[Tuple[datetime, int]] = None,
+    ) -> list:
+        """
+        Retrieve a page of directory metadata from PostgreSQL, newest first.
+        To fetch the next page, pass the (uploaded_at, id) of the last row returned as `before`.
+        Uses keyset pagination, so deep pages cost the same as the first.
+        """
+        conditions = []
+        params = {"limit": limit}
+        if dirname:
+            # retrieve a specific directory
+            conditions.append("dirname = :dirname")
+            params["dirname"] = dirname
+        if before is not None:
+            # id breaks ties between rows uploaded in the same transaction
+            conditions.append("(uploaded_at, id) < (:before_uploaded_at, :before_id)")
+            params["before_uploaded_at"], params["before_id"] = before
+
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        with self.pg.get_connection() as conn:
+            self._ensure_tables_exist(conn)
+
+            result = conn.execute(
+                text(f"""
+                    SELECT id, dirname, file_count, total_size, files_json, uploaded_at
+                    FROM directory_metadata
+                    {where}
+                    ORDER BY uploaded_at DESC, id DESC
+                    LIMIT :limit
+                """),
+                params
+            )
 
             return result.fetchall()
 
+    def iter_directory_metadata(self, dirname: Optional[str] = None, batch_size: int = 500) -> Iterator:
+        """
+        Stream all directory metadata rows (newest first) through a server-side cursor,
+        holding at most `batch_size` rows in memory at a time.
+        """
+        where = "WHERE dirname = :dirname" if dirname else ""
+
+        with self.pg.get_connection() as conn:
+            self._ensure_tables_exist(conn)
+
+            result = conn.execution_options(stream_results=True, yield_per=batch_size).execute(
+                text(f"""
+                    SELECT id, dirname, file_count, total_size, files_json, uploaded_at
+                    FROM directory_metadata
+                    {where}
+                    ORDER BY uploaded_at DESC, id DESC
+                """),
+                {"dirname": dirname} if dirname else {}
+            )
+            yield from result
+
     def get_processing_stats(self) -> dict:
         """Get statistics about directory processing"""
         with self.pg.get_connection() as conn:
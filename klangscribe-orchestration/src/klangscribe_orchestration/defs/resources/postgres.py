@@ -1,10 +1,62 @@
+import atexit
+import io
+import threading
 from contextlib import contextmanager
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Iterable, Iterator, List, Sequence
 from urllib.parse import quote_plus
 
 import dagster as dg
+import orjson
+from psycopg2 import sql
 from pydantic import PrivateAttr
 from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Engine
+
+
+# Process-wide engines keyed by connection URL, since Dagster re-instantiates resources per run/op
+_ENGINES: Dict[str, Engine] = {}
+_ENGINES_LOCK = threading.Lock()
+
+
+# Characters COPY's text format reads as escapes or delimiters
+_COPY_TEXT_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+
+
+class _CopyTextStream(io.TextIOBase):
+    """Read-only file over rows in COPY text format, rendered only as psycopg2 reads them"""
+
+    def __init__(self, rows: Iterable[Sequence[Any]]):
+        self._lines = (
+            "\t".join(r"\N" if value is None else str(value).translate(_COPY_TEXT_ESCAPES) for value in row) + "\n"
+            for row in rows
+        )
+        self._buf = ""
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: Optional[int] = -1) -> str:
+        if size is None or size < 0:
+            chunk, self._buf = self._buf + "".join(self._lines), ""
+            return chunk
+
+        parts, length = [self._buf], len(self._buf)
+        for line in self._lines:
+            parts.append(line)
+            length += len(line)
+            if length >= size:
+                break
+        data = "".join(parts)
+        chunk, self._buf = data[:size], data[size:]
+        return chunk
+
+
+@atexit.register
+def _dispose_engines() -> None:
+    with _ENGINES_LOCK:
+        for engine in _ENGINES.values():
+            engine.dispose()
+        _ENGINES.clear()
 
 
 class PostgresResource(dg.ConfigurableResource):
@@ -21,12 +73,33 @@ class PostgresResource(dg.ConfigurableResource):
     def _get_engine(self):
         if self._engine is None:
             url = f"postgresql+psycopg2://{quote_plus(self.user)}:{quote_plus(self.password)}@{self.host}:{self.port}/{self.database}"
-            self._engine = create_engine(url)
+            with _ENGINES_LOCK:
+                engine = _ENGINES.get(url)
+                if engine is None:
+                    engine = create_engine(
+                        url,
+                        # Dagster can run several ops (and upload threads) against one process-wide engine
+                        pool_size=16,
+                        max_overflow=16,
+                        # Drop connections the server or a NAT closed while idle instead of failing the op,
+                        # and retire them before typical idle timeouts
+                        pool_pre_ping=True,
+                        pool_recycle=1800,
+                        # Reuse the most recently returned connection so idle extras can age out
+                        pool_use_lifo=True,
+                        connect_args={
+                            "keepalives": 1,
+                            "keepalives_idle": 30,
+                            "application_name": "klangscribe",
+                        },
+                    )
+                    _ENGINES[url] = engine
+            self._engine = engine
         return self._engine
 
     @contextmanager
     def get_connection(self):
-        """Get database connection with automatic commit/rollback"""
+        """Get pooled database connection with automatic commit/rollback"""
         engine = self._get_engine()
         with engine.connect() as conn:
             try:
@@ -36,7 +109,58 @@ class PostgresResource(dg.ConfigurableResource):
                 conn.rollback()
                 raise
 
+    @contextmanager
+    def get_cursor(self):
+        """Get pooled raw psycopg2 cursor (for bulk helpers) with automatic commit/rollback"""
+        raw_conn = self._get_engine().raw_connection()
+        try:
+            with raw_conn.cursor() as cursor:
+                yield cursor
+            raw_conn.commit()
+        except Exception:
+            raw_conn.rollback()
+            raise
+        finally:
+            # returns the connection to the pool
+            raw_conn.close()
+
     def fetchall(self, query: str, params: Optional[Dict[str, Any]] = None) -> list:
         with self.get_connection() as conn:
             result = conn.execute(text(query), params or {})
             return list(result.fetchall())
+
+    def iter_query(self, query: str, params: Optional[Dict[str, Any]] = None, batch_size: int = 5000) -> Iterator[list]:
+        """Stream query results in batches of rows through a server-side cursor"""
+        with self.get_connection() as conn:
+            result = conn.execution_options(stream_results=True, yield_per=batch_size).execute(text(query), params or {})
+            for partition in result.partitions(batch_size):
+                yield list(partition)
+
+    def bulk_copy(self, table: str, columns: Sequence[str], rows: Iterable[Sequence[Any]]) -> None:
+        """Load rows into `table` with a single COPY ... FROM STDIN instead of per-row INSERTs"""
+        with self.get_cursor() as cursor:
+            self.copy_rows(cursor, table, columns, rows)
+
+    def copy_rows(self, cursor, table: str, columns: Sequence[str], rows: Iterable[Sequence[Any]]) -> None:
+        """
+        COPY rows into `table` on the caller's cursor (and transaction), streaming them as they are
+        generated instead of building the whole payload in memory first
+        """
+        copy_sql = sql.SQL("COPY {} ({}) FROM STDIN").format(
+            sql.Identifier(table),
+            sql.SQL(", ").join(sql.Identifier(column) for column in columns),
+        )
+        cursor.copy_expert(copy_sql, _CopyTextStream(rows))
+
+    def bulk_insert_json(self, table: str, columns: Sequence[str], records: List[Dict[str, Any]]) -> None:
+        """
+        Insert dict records (keyed by column name) with one INSERT ... SELECT FROM json_populate_recordset,
+        so the whole batch is a single bind parameter, parsed and planned once. Columns left out keep their defaults.
+        """
+        column_list = sql.SQL(", ").join(sql.Identifier(column) for column in columns)
+        insert_sql = sql.SQL("INSERT INTO {table} ({columns}) SELECT {columns} FROM json_populate_recordset(NULL::{table}, %s)").format(
+            table=sql.Identifier(table),
+            columns=column_list,
+        )
+        with self.get_cursor() as cursor:
+            cursor.execute(insert_sql, (orjson.dumps(records).decode(),))
@@ -2,6 +2,7 @@ import os
 import io
 import time
 import logging
+import threading
 
 # Required before importing boto3:
 os.environ['AWS_REQUEST_CHECKSUM_CALCULATION'] = 'when_required'
@@ -9,15 +10,45 @@ os.environ['AWS_RESPONSE_CHECKSUM_VALIDATION'] = 'when_required'
 
 import boto3
 
+from boto3.s3.transfer import TransferConfig
 from botocore.config import Config
 from botocore.exceptions import ClientError
 from pydantic import PrivateAttr
-from typing import Optional
+from typing import Dict, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
 import dagster as dg
 
+from ...utils.env import positive_int_env
+
+
+# Multipart settings for collected files and manifests: objects above the threshold go up as parts in parallel,
+# each retried individually. upload_fileobj holds up to chunksize * max_concurrency bytes in memory
+_TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=positive_int_env("S3_MULTIPART_THRESHOLD_MB", 64) * 1024 * 1024,
+    multipart_chunksize=positive_int_env("S3_MULTIPART_CHUNK_MB", 16) * 1024 * 1024,
+    max_concurrency=positive_int_env("S3_MULTIPART_CONCURRENCY", 4),
+    use_threads=True,
+)
+
+# `process_directory` uploads this many files at once, each sending up to `max_concurrency` parts.
+# The client pool is sized to match (capped), so no request has to open and then discard a connection
+_UPLOAD_CONCURRENCY = positive_int_env("S3_UPLOAD_CONCURRENCY", 16)
+_MAX_POOL_CONNECTIONS = min(_UPLOAD_CONCURRENCY * _TRANSFER_CONFIG.max_concurrency, 128)
+
+# Read buffer for files sent as a single PUT. The HTTP layer pulls the body in small blocks,
+# which the buffer turns into one read syscall per MiB
+_UPLOAD_READ_BUFFER_SIZE = 1024 * 1024
+
+# Process-wide boto3 clients keyed by connection settings (see `postgres._ENGINES`)
+_CLIENTS: Dict[Tuple[Optional[str], str, str, str], object] = {}
+_CLIENTS_LOCK = threading.Lock()
+
+# (endpoint, bucket) pairs already confirmed to exist, so head_bucket runs once per bucket per process
+_VALIDATED_BUCKETS: set = set()
+_VALIDATED_BUCKETS_LOCK = threading.Lock()
+
 
 class S3Resource(dg.ConfigurableResource):
     """Resource for interacting with an S3 object storage server."""
@@ -32,22 +63,39 @@ class S3Resource(dg.ConfigurableResource):
     def get_client(self):
         """Get boto3 S3 client (cached, thread-safe)."""
         if self._client is None:
-            self._client = boto3.client(
-                's3',
-                endpoint_url=self.endpoint,
-                aws_access_key_id=self.access_key,
-                aws_secret_access_key=self.secret_key,
-                region_name=self.region,
-                config=Config(
-                    max_pool_connections=20,
-                    retries={'max_attempts': 3, 'mode': 'adaptive'},
-                    connect_timeout=10,
-                    read_timeout=30,
-                ),
-            )
+            key = (self.endpoint, self.access_key, self.secret_key, self.region)
+            with _CLIENTS_LOCK:
+                client = _CLIENTS.get(key)
+                if client is None:
+                    client = boto3.client(
+                        's3',
+                        endpoint_url=self.endpoint,
+                        aws_access_key_id=self.access_key,
+                        aws_secret_access_key=self.secret_key,
+                        region_name=self.region,
+                        config=Config(
+                            max_pool_connections=_MAX_POOL_CONNECTIONS,
+                            retries={'max_attempts': 5, 'mode': 'adaptive'},
+                            connect_timeout=10,
+                            read_timeout=30,
+                            tcp_keepalive=True,
+                        ),
+                    )
+                    _CLIENTS[key] = client
+            self._client = client
         return self._client
     
     def _validate_bucket(self, s3_client, bucket_name: str) -> None:
+        key = (self.endpoint, bucket_name)
+        if key in _VALIDATED_BUCKETS:
+            return
+
+        with _VALIDATED_BUCKETS_LOCK:
+            if key not in _VALIDATED_BUCKETS:
+                self._ensure_bucket(s3_client, bucket_name)
+                _VALIDATED_BUCKETS.add(key)
+
+    def _ensure_bucket(self, s3_client, bucket_name: str) -> None:
         # Create bucket if it doesn't exist
         try:
             s3_client.head_bucket(Bucket=bucket_name)
@@ -69,14 +117,27 @@ class S3Resource(dg.ConfigurableResource):
                 raise Exception(f"Failed to check bucket {bucket_name}: {e}")
 
     def upload_file(self, bucket_name: str, object_key: str, file_path: str) -> str:
-        """Uploads a file to S3-compatible storage"""
+        """
+        Uploads a file to S3-compatible storage.
+        Returns the storage path as "<bucket>/<key>" (no scheme), the format downstream assets split on.
+        """
         s3_client = self.get_client()
 
         # Ensure bucket exists
         self._validate_bucket(s3_client, bucket_name)
 
         # Upload the file
-        s3_client.upload_file(file_path, bucket_name, object_key)
+        with open(file_path, "rb", buffering=_UPLOAD_READ_BUFFER_SIZE) as f:
+            fd = f.fileno()
+            if os.fstat(fd).st_size < _TRANSFER_CONFIG.multipart_threshold:
+                if hasattr(os, "posix_fadvise"):
+                    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+                s3_client.upload_fileobj(f, bucket_name, object_key, Config=_TRANSFER_CONFIG)
+                return f"{bucket_name}/{object_key}"
+
+        # Multipart uploads go by path: upload_fileobj would copy every in-flight part into memory,
+        # while upload_file reads each part lazily from its own file handle
+        s3_client.upload_file(file_path, bucket_name, object_key, Config=_TRANSFER_CONFIG)
 
         return f"{bucket_name}/{object_key}"
     
@@ -89,6 +150,20 @@ class S3Resource(dg.ConfigurableResource):
         # Write bytes
         s3_client.put_object(Bucket=bucket_name, Key=obj_key, Body=data, ContentType=content_type)
 
+    def put_large_object(self, bucket_name: str, obj_key: str, fileobj, content_type: str = "application/octet-stream") -> None:
+        """Streams a (seekable) file object to S3, switching to a parallel multipart upload for large objects"""
+        s3_client = self.get_client()
+
+        # Ensure bucket exists
+        self._validate_bucket(s3_client, bucket_name)
+
+        # Upload file object
+        s3_client.upload_fileobj(
+            fileobj, bucket_name, obj_key,
+            ExtraArgs={"ContentType": content_type},
+            Config=_TRANSFER_CONFIG,
+        )
+
     def get_object(self, bucket_name: str, obj_key: str, max_retries: int = 3):
         """
         Reads a single s3 object into memory, retrying on NoSuchKey to guard
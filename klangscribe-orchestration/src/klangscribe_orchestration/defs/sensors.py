@@ -1,82 +1,172 @@
 import os
+import json
+import time
+import heapq
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Union
 
 import dagster as dg
 
 from .jobs.collection import DirConfig
 from .resources import DirectoryProcessingResource
+from ..utils.env import positive_int_env
+
+
+# Sensor settings come from the environment, which doesn't change while the code server runs
+_WATCH_DIR = os.getenv("WATCH_DIR", "/mnt/watch_dir")
+_MAX_DIRS_PER_RUN = positive_int_env("SENSOR_BATCH_SIZE", 20)
+
+# After a minute without runs, the time between watch dir checks doubles each further idle minute, up to 30s
+_IDLE_BEFORE_BACKOFF_NS = 60 * 1_000_000_000
+_MIN_CHECK_INTERVAL_NS = 2 * 1_000_000_000
+_MAX_CHECK_INTERVAL_NS = 30 * 1_000_000_000
+
+# Watch dirs with more entries than this are classified on a thread pool, in chunks of this size
+_PARALLEL_SCAN_THRESHOLD = 5000
+
+
+def _idle_check_interval_ns(idle_ns: int) -> int:
+    """Minimum time between watch dir checks after `idle_ns` without runs; 0 checks on every tick"""
+    if idle_ns < _IDLE_BEFORE_BACKOFF_NS:
+        return 0
+    doublings = min(idle_ns // _IDLE_BEFORE_BACKOFF_NS, 4)
+    return min(_MIN_CHECK_INTERVAL_NS << doublings, _MAX_CHECK_INTERVAL_NS)
+
+
+def _subdirs(entries: List[os.DirEntry]) -> List[os.DirEntry]:
+    return [entry for entry in entries if entry.is_dir(follow_symlinks=False)]
+
+
+def _scan_watch_dir(watch_dir: str) -> Dict[str, os.DirEntry]:
+    """Map each subdirectory name in `watch_dir` to its DirEntry, classifying large dirs on a thread pool"""
+    with os.scandir(watch_dir) as it:
+        entries = list(it)
+
+    if len(entries) <= _PARALLEL_SCAN_THRESHOLD:
+        subdirs = _subdirs(entries)
+    else:
+        chunks = [entries[i:i + _PARALLEL_SCAN_THRESHOLD] for i in range(0, len(entries), _PARALLEL_SCAN_THRESHOLD)]
+        with ThreadPoolExecutor(max_workers=min(len(chunks), os.cpu_count() or 1)) as executor:
+            subdirs = [entry for chunk in executor.map(_subdirs, chunks) for entry in chunk]
+
+    return {entry.name: entry for entry in subdirs}
+
+
+def _dir_run_config(dirname: str, dirpath: str) -> dg.RunConfig:
+    """Run config for `dir_collection_job`; both ops read the same `DirConfig` values"""
+    op_config = {"config": {"dirname": dirname, "dirpath": dirpath}}
+    return dg.RunConfig(ops={"process_directory": op_config, "delete_src_dir": op_config})
+
 
 @dg.sensor(
     job_name="dir_collection_job",
     minimum_interval_seconds=2,
     default_status=dg.DefaultSensorStatus.STOPPED
 )
-def new_file_sensor(context: dg.SensorEvaluationContext, dir_proc: DirectoryProcessingResource) -> dg.SensorResult:
+def new_file_sensor(context: dg.SensorEvaluationContext, dir_proc: DirectoryProcessingResource) -> Iterator[Union[dg.RunRequest, dg.SkipReason]]:
     """
     Check for new directories every 10 seconds.
     Uses PostgreSQL to track which directories have been processed.
     """
     
-    watch_dir = os.getenv("WATCH_DIR", "/mnt/watch_dir")
-    max_dirs_per_run = int(os.getenv("SENSOR_BATCH_SIZE", "20"))
+    watch_dir = _WATCH_DIR
+    max_dirs_per_run = _MAX_DIRS_PER_RUN
+
+    cursor_state = json.loads(context.cursor) if context.cursor else {}
+
+    # Back off while idle: skip ticks (leaving the cursor as is) until the check interval has passed
+    now_ns = time.time_ns()
+    idle_ns = now_ns - cursor_state.get("last_activity_ns", now_ns)
+    check_interval_ns = _idle_check_interval_ns(idle_ns)
+    if now_ns - cursor_state.get("last_check_ns", 0) < check_interval_ns:
+        yield dg.SkipReason(f"Idle for {idle_ns // 1_000_000_000}s, backing off")
+        return
+
+    # Checks are only recorded once backing off, so the first idle minute writes no cursor on unchanged ticks
+    backing_off = check_interval_ns > 0
+    if backing_off:
+        cursor_state["last_check_ns"] = now_ns
 
-    # Get current directories on disk
     try:
-        all_items = os.listdir(watch_dir)
-        current_dirs = set([
-            item for item in all_items
-            if os.path.isdir(os.path.join(watch_dir, item))
-        ])
+        # The watch dir's own mtime only changes when entries are added, removed or renamed,
+        # so an unchanged mtime (with nothing left over from the last tick) means nothing new
+        watch_dir_mtime_ns = os.stat(watch_dir).st_mtime_ns
+        if watch_dir_mtime_ns == cursor_state.get("watch_dir_mtime_ns"):
+            if backing_off:
+                context.update_cursor(json.dumps(cursor_state))
+            yield dg.SkipReason("Watched folder unchanged since last check")
+            return
+
+        # Get current directories on disk. Entries are kept so a later stat() is cached on them
+        current_dirs = _scan_watch_dir(watch_dir)
     except FileNotFoundError:
         context.log.warning(f"Directory not found: {watch_dir}")
-        return dg.SkipReason(f"Directory not found: {watch_dir}")
-
-    if not current_dirs:
-        return dg.SkipReason("No directories found in watched folder")
-    
-    # Get directories already in database (processing, completed, or failed)
-    processed_dirs = dir_proc.get_processed_directories()
-
-    # Find directories that exist but haven't been processed
-    new_dirs = current_dirs - processed_dirs
+        if backing_off:
+            context.update_cursor(json.dumps(cursor_state))
+        yield dg.SkipReason(f"Directory not found: {watch_dir}")
+        return
+
+    # Only trust an mtime that is safely in the past: a directory created just after the scan, within
+    # the same filesystem timestamp tick, would leave it unchanged
+    settled_mtime_ns = watch_dir_mtime_ns if now_ns - watch_dir_mtime_ns > 1_000_000_000 else None
+
+    # Directories already known to be in the database, carried between ticks in the cursor
+    # (names no longer on disk are dropped, so the cursor stays bounded by the watch dir's size)
+    known_dirs = current_dirs.keys() & cursor_state.get("known_dirs", [])
+
+    # Find directories that exist but haven't been processed (not in database as processing,
+    # completed, or failed). Only names not yet known are checked, and the anti-join runs in
+    # Postgres, so the database is skipped entirely when nothing new appeared
+    candidates = current_dirs.keys() - known_dirs
+    new_dirs = dir_proc.find_unprocessed_directories(candidates) if candidates else set()
+    known_dirs |= candidates - new_dirs
 
     if not new_dirs:
-        return dg.SkipReason(f"No new directories (found {len(current_dirs)} existing)")
-
-    # Sort and limit
-    new_dirs_list = sorted(new_dirs)[:min(max_dirs_per_run, len(new_dirs))]
-
-    context.log.info(f"Found {len(new_dirs_list)} new directories: {new_dirs_list}")
-
-    # Trigger job for each new directory
-    for dirname in sorted(new_dirs_list):    # Sort for consistent ordering
+        cursor_state.setdefault("last_activity_ns", now_ns)
+        cursor_state.update(known_dirs=sorted(known_dirs), watch_dir_mtime_ns=settled_mtime_ns)
+        context.update_cursor(json.dumps(cursor_state))
+
+        if not current_dirs:
+            yield dg.SkipReason("No directories found in watched folder")
+            return
+        yield dg.SkipReason(f"No new directories (found {len(current_dirs)} existing)")
+        return
+
+    # Take the first batch in name order; a partial sort, since a backfill can leave many more pending
+    new_dirs_list = heapq.nsmallest(max_dirs_per_run, new_dirs)
+
+    # Mark the whole batch as processing in database in one round trip (prevents duplicate processing).
+    # This is atomic - uses database constraint; only directories claimed here are returned
+    claimed_dirs = dir_proc.mark_directories_as_processing(new_dirs_list, run_id=None)
+
+    # Every directory in the batch is now in the database, whether claimed here or by someone else.
+    # Directories beyond the batch limit are still pending, so the next tick must rescan
+    known_dirs.update(new_dirs_list)
+    cursor_state.pop("last_check_ns", None)
+    cursor_state.update(
+        known_dirs=sorted(known_dirs),
+        last_activity_ns=now_ns,
+        watch_dir_mtime_ns=settled_mtime_ns if len(new_dirs_list) == len(new_dirs) else None,
+    )
+    context.update_cursor(json.dumps(cursor_state))
+
+    # Trigger job for each new directory, logging the batch once rather than per directory
+    triggered = []
+    for dirname in new_dirs_list:    # Sorted for consistent ordering
         dirpath = os.path.join(watch_dir, dirname)
 
-        # Mark as processing in database (prevents duplicate processing)
-        # This is atomic - uses database constraint
-        if dir_proc.mark_directory_as_processing(dirname, run_id=None):
-            context.log.info(f"Triggering job for: {dirname}")
+        if dirname in claimed_dirs:
+            triggered.append(dirname)
 
             yield dg.RunRequest(
-                run_key=f"dir_{dirname}_{os.path.getmtime(dirpath)}",
-                run_config=dg.RunConfig(
-                    ops={
-                        "process_directory": {
-                            "config": {
-                                "dirname": dirname,
-                                "dirpath": dirpath
-                            }
-                        },
-                        "delete_src_dir": {
-                            "config": {
-                                "dirname": dirname,
-                                "dirpath": dirpath
-                            }
-                        }
-                    }
-                )
+                # stat() is cached on the DirEntry, so this is the only stat for the directory
+                run_key=f"dir_{dirname}_{current_dirs[dirname].stat(follow_symlinks=False).st_mtime}",
+                run_config=_dir_run_config(dirname, dirpath)
             )
         else:
-            context.log.info(f"Directory {dirname} already queued/processing, skipping")
+            context.log.debug(f"Directory {dirname} already queued/processing, skipping")
+
+    context.log.info(f"Triggered {len(triggered)} of {len(new_dirs)} new directories: {triggered}")
 
 
 
@@ -1,2 +1,3 @@
 from .audio_processing import *
-from .raw_processing import *
\ No newline at end of file
+from .raw_processing import *
+from .env import *
\ No newline at end of file
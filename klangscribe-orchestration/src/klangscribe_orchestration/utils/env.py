@@ -0,0 +1,21 @@
+#
+# file: src/klangscribe-orchestration/utils/env.py
+# desc: Utilities for reading settings from environment variables
+#
+
+import os
+
+import dagster as dg
+
+
+def positive_int_env(name: str, default: int) -> int:
+    """Positive integer from the environment, or `default` (with a warning) if unset or invalid"""
+    value = os.getenv(name)
+    try:
+        parsed = int(value) if value is not None else default
+    except ValueError:
+        parsed = 0
+    if parsed < 1:
+        dg.get_dagster_logger().warning(f"Invalid {name}={value!r}, expected a positive integer; using {default}")
+        return default
+    return parsed
@@ -0,0 +1,13 @@
+import pytest
+
+from klangscribe_orchestration.utils.env import positive_int_env
+
+
+@pytest.mark.parametrize("value, expected", [(None, 20), ("7", 7), ("", 20), ("abc", 20), ("16MB", 20), ("0", 20), ("-3", 20)])
+def test_positive_int_env_falls_back_on_bad_values(monkeypatch, value, expected):
+    if value is None:
+        monkeypatch.delenv("KLANGSCRIBE_TEST_SETTING", raising=False)
+    else:
+        monkeypatch.setenv("KLANGSCRIBE_TEST_SETTING", value)
+
+    assert positive_int_env("KLANGSCRIBE_TEST_SETTING", 20) == expected
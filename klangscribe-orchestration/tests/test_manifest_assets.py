@@ -0,0 +1,173 @@
+import json
+import random
+import re
+from collections import Counter
+from datetime import datetime, timedelta
+
+import pytest
+
+from klangscribe_orchestration.defs.assets.manifest_assets import (
+    REQUIRED_EXTS,
+    _collect_valid_song_batches,
+    _collect_valid_songs,
+)
+
+
+UUID_PREFIX = "s3://uns/0123abcd-4567-89ab-cdef-0123456789ab"
+
+
+#### Reference: the per-directory loop `_collect_valid_songs` replaced ####
+
+
+def _lname(f):
+    return str(f.get("filename", "")).strip().lower()
+
+
+def _remove_s3_uuid_prefix(storage_path):
+    return re.sub(r'^s3://uns/[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}', '', storage_path).strip()
+
+
+def _pick_single_storage_path(files, ext):
+    candidates = [f for f in files if _lname(f).endswith(ext)]
+    if not candidates:
+        return None
+    candidates.sort(key=lambda x: (int(x.get("file_size", 0) or 0), _lname(x)), reverse=True)
+    return _remove_s3_uuid_prefix(str(candidates[0].get("storage_path")))
+
+
+def _sorted_opus_paths(files):
+    opus = [f for f in files if _lname(f).endswith(".opus")]
+    opus.sort(key=lambda x: (_lname(x), str(x.get("storage_path", ""))))
+    return [_remove_s3_uuid_prefix(str(f.get("storage_path"))) for f in opus if f.get("storage_path")]
+
+
+def _reference_collect_valid_songs(result_rows):
+    rows = []
+    for dir_id, dirname, _, _, files_json, uploaded_at in result_rows:
+        # NULL file lists come from the server-side required-files check
+        files = [f for f in files_json or [] if _lname(f).endswith(REQUIRED_EXTS)]
+        opus_paths = _sorted_opus_paths(files)
+        chart_path = _pick_single_storage_path(files, ".chart")
+        ini_path = _pick_single_storage_path(files, ".ini")
+        if not opus_paths or not chart_path or not ini_path:
+            continue
+        rows.append({
+            "dir_id": str(dir_id),
+            "dirname": dirname,
+            "ini_path": ini_path,
+            "chart_path": chart_path,
+            "opus_paths": opus_paths,
+            "uploaded_at": uploaded_at.strftime("%Y-%m-%d %H:%M:%S"),
+        })
+    metadata = {"total_songs": len(result_rows), "kept_dirs": len(rows), "dropped_missing": len(result_rows) - len(rows)}
+    return rows, metadata
+
+
+#### Helpers ####
+
+
+def _as_dicts(df):
+    rows = df.to_dicts()
+    for row in rows:
+        row["opus_paths"] = json.loads(row["opus_paths"])
+    return rows
+
+
+def _file(filename, storage_path, file_size=100):
+    return {"filename": filename, "storage_path": storage_path, "file_size": file_size}
+
+
+def _song(dir_id, files, uploaded_at=datetime(2024, 5, 1, 12, 30, 15, 123456)):
+    return (dir_id, f"song_{dir_id}", len(files or []), 0, files, uploaded_at)
+
+
+def _random_song(rng, dir_id):
+    names = ["song", "guitar", "drums", "Vocals", "notes", "chart", "a.b"]
+    exts = [".opus", ".OPUS", ".chart", ".ini", ".INI", ".mid", ".txt", ".png", ""]
+    # Most songs start out complete, so the random extras exercise tie-breaks and ordering, not just drops
+    files = []
+    if rng.random() < 0.7:
+        files = [_file(f"base{ext}", f"bucket/{dir_id}/base{ext}", rng.choice([10, 500])) for ext in REQUIRED_EXTS]
+    for _ in range(rng.randint(0, 8)):
+        filename = rng.choice(names) + rng.choice(exts) + rng.choice(["", " "])
+        storage_path = rng.choice(["", f"bucket/{dir_id}/{filename.strip()}", f"{UUID_PREFIX}bucket/{dir_id}/x{rng.randint(0, 3)}"])
+        files.append(_file(filename, storage_path, rng.choice([None, 0, 10, 10, 500])))
+    return _song(dir_id, rng.choice([files, files, files, None]), datetime(2024, 1, 1) + timedelta(seconds=rng.randint(0, 10**7)))
+
+
+#### Tests ####
+
+
+def test_keeps_songs_with_every_required_file():
+    rows = [
+        _song(1, [
+            _file("song.ini", "bucket/1/song.ini"),
+            _file("notes.chart", f"{UUID_PREFIX}bucket/1/notes.chart "),
+            _file("Vocals.opus", "bucket/1/Vocals.opus"),
+            _file("drums.opus", "bucket/1/drums.opus"),
+            _file("cover.png", "bucket/1/cover.png"),
+        ]),
+        # missing .ini
+        _song(2, [_file("notes.chart", "bucket/2/notes.chart"), _file("song.opus", "bucket/2/song.opus")]),
+        # duplicate .chart: the largest one wins
+        _song(3, [
+            _file("song.ini", "bucket/3/song.ini"),
+            _file("a.chart", "bucket/3/a.chart", 10),
+            _file("b.chart", "bucket/3/b.chart", 20),
+            _file("song.opus", "bucket/3/song.opus"),
+        ]),
+        # files dropped by the server-side check
+        _song(4, None),
+    ]
+
+    result, metadata = _collect_valid_songs(rows)
+
+    assert _as_dicts(result) == [
+        {
+            "dir_id": "1",
+            "dirname": "song_1",
+            "ini_path": "bucket/1/song.ini",
+            "chart_path": "bucket/1/notes.chart",
+            "opus_paths": ["bucket/1/drums.opus", "bucket/1/Vocals.opus"],
+            "uploaded_at": "2024-05-01 12:30:15",
+        },
+        {
+            "dir_id": "3",
+            "dirname": "song_3",
+            "ini_path": "bucket/3/song.ini",
+            "chart_path": "bucket/3/b.chart",
+            "opus_paths": ["bucket/3/song.opus"],
+            "uploaded_at": "2024-05-01 12:30:15",
+        },
+    ]
+    assert metadata == {"total_songs": 4, "kept_dirs": 2, "dropped_missing": 2}
+
+
+def test_empty_input():
+    result, metadata = _collect_valid_songs([])
+
+    assert result.height == 0
+    assert result.columns == ["dir_id", "dirname", "ini_path", "chart_path", "opus_paths", "uploaded_at"]
+    assert metadata == {"total_songs": 0, "kept_dirs": 0, "dropped_missing": 0}
+
+
+@pytest.mark.parametrize("seed", range(25))
+def test_matches_reference_loop(seed):
+    rng = random.Random(seed)
+    rows = [_random_song(rng, dir_id) for dir_id in range(rng.randint(1, 40))]
+
+    result, metadata = _collect_valid_songs(rows)
+
+    assert (_as_dicts(result), metadata) == _reference_collect_valid_songs(rows)
+
+
+def test_batches_match_single_pass():
+    rng = random.Random(0)
+    rows = [_random_song(rng, dir_id) for dir_id in range(60)]
+    counts = Counter()
+
+    batches = list(_collect_valid_song_batches([rows[:25], [], rows[25:]], counts))
+
+    expected_rows, expected_metadata = _reference_collect_valid_songs(rows)
+    assert [row for batch in batches for row in _as_dicts(batch)] == expected_rows
+    assert dict(counts) == expected_metadata
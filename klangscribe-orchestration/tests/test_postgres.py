@@ -0,0 +1,69 @@
+from contextlib import contextmanager
+from unittest import mock
+
+import pytest
+from psycopg2 import sql
+
+from klangscribe_orchestration.defs.resources import PostgresResource
+from klangscribe_orchestration.defs.resources.postgres import _CopyTextStream
+
+
+ROWS = [
+    (1, "plain", None),
+    (2, "tab\there", "new\nline"),
+    (3, "back\\slash", "\\N"),
+    (4, 'quote "and" comma, ', "carriage\r\nreturn"),
+    (5, "", "ünïcødé"),
+]
+
+# The same rows in COPY text format: tab-separated, \N for NULL, and backslash escapes for
+# backslashes, tabs and line breaks (so a literal "\N" string can't be read back as NULL)
+EXPECTED = (
+    "1\tplain\t\\N\n"
+    "2\ttab\\there\tnew\\nline\n"
+    "3\tback\\\\slash\t\\\\N\n"
+    '4\tquote "and" comma, \tcarriage\\r\\nreturn\n'
+    "5\t\tünïcødé\n"
+)
+
+
+def test_copy_text_stream_escapes_rows():
+    assert _CopyTextStream(ROWS).read() == EXPECTED
+
+
+@pytest.mark.parametrize("size", [1, 3, 7, 8192])
+def test_copy_text_stream_reads_in_chunks(size):
+    stream = _CopyTextStream(ROWS)
+    chunks = iter(lambda: stream.read(size), "")
+
+    assert "".join(chunks) == EXPECTED
+
+
+def test_copy_text_stream_pulls_rows_lazily():
+    rows = iter(ROWS)
+    stream = _CopyTextStream(rows)
+
+    assert stream.read(5) == "1\tpla"
+    # Only the first row has been rendered so far
+    assert next(rows) == ROWS[1]
+
+
+def test_bulk_copy_streams_rows_to_copy():
+    pg = PostgresResource(host="localhost", user="user", password="password", database="db")
+    cursor = mock.Mock()
+
+    @contextmanager
+    def get_cursor():
+        yield cursor
+
+    copied = {}
+    cursor.copy_expert.side_effect = lambda statement, stream: copied.update(statement=statement, data=stream.read())
+
+    with mock.patch.object(PostgresResource, "get_cursor", side_effect=get_cursor):
+        pg.bulk_copy("directory_metadata", ("id", "dirname", "files_json"), ROWS)
+
+    assert copied["data"] == EXPECTED
+    assert copied["statement"] == sql.SQL("COPY {} ({}) FROM STDIN").format(
+        sql.Identifier("directory_metadata"),
+        sql.SQL(", ").join([sql.Identifier("id"), sql.Identifier("dirname"), sql.Identifier("files_json")]),
+    )
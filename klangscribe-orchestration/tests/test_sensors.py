@@ -0,0 +1,202 @@
+import json
+import os
+import types
+from unittest import mock
+
+import dagster as dg
+import pytest
+
+from klangscribe_orchestration.defs import sensors
+
+
+SECOND_NS = 1_000_000_000
+
+
+class Clock:
+    """Stand-in for the sensor's `time` module, advanced by hand"""
+
+    def __init__(self, now_ns: int):
+        self.now_ns = now_ns
+
+    def time_ns(self) -> int:
+        return self.now_ns
+
+    def advance(self, seconds: float) -> None:
+        self.now_ns += int(seconds * SECOND_NS)
+
+
+@pytest.fixture
+def watch_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(sensors, "_WATCH_DIR", str(tmp_path))
+    return tmp_path
+
+
+@pytest.fixture
+def clock(watch_dir, monkeypatch):
+    # Start well after the watch dir's mtime, so it counts as settled
+    clock = Clock(os.stat(watch_dir).st_mtime_ns + 10 * SECOND_NS)
+    monkeypatch.setattr(sensors, "time", types.SimpleNamespace(time_ns=clock.time_ns))
+    return clock
+
+
+@pytest.fixture
+def dir_proc():
+    """Database stand-in where every directory is new and every claim succeeds"""
+    # Limited to the methods the sensor calls: a full autospec would pass for a
+    # ConfigurableResource, which Dagster unwraps instead of handing through
+    dir_proc = mock.Mock(spec=["find_unprocessed_directories", "mark_directories_as_processing"])
+    dir_proc.find_unprocessed_directories.side_effect = lambda candidates, *args, **kwargs: set(candidates)
+    dir_proc.mark_directories_as_processing.side_effect = lambda dirnames, *args, **kwargs: set(dirnames)
+    return dir_proc
+
+
+class Sensor:
+    """Runs sensor ticks, carrying the cursor from one tick to the next"""
+
+    def __init__(self, dir_proc):
+        self.dir_proc = dir_proc
+        self.cursor = None
+        self.cursor_updated = False
+
+    def tick(self):
+        with dg.build_sensor_context(resources={"dir_proc": self.dir_proc}, cursor=self.cursor) as context:
+            result = sensors.new_file_sensor.evaluate_tick(context)
+            self.cursor_updated = context.cursor_updated
+        self.cursor = result.cursor
+        return result
+
+    @property
+    def state(self) -> dict:
+        return json.loads(self.cursor)
+
+
+def _dirnames(result) -> list:
+    return [request.run_config["ops"]["process_directory"]["config"]["dirname"] for request in result.run_requests]
+
+
+def _mkdirs(watch_dir, clock, *names) -> None:
+    for name in names:
+        (watch_dir / name).mkdir()
+    # Keep the clock ahead of the new mtime, so the scan result can be trusted
+    clock.now_ns = max(clock.now_ns, os.stat(watch_dir).st_mtime_ns + 10 * SECOND_NS)
+
+
+def test_first_tick_requests_runs_for_every_directory(watch_dir, clock, dir_proc):
+    _mkdirs(watch_dir, clock, "song_b", "song_a")
+    (watch_dir / "notes.txt").write_text("not a directory")
+    sensor = Sensor(dir_proc)
+
+    result = sensor.tick()
+
+    assert _dirnames(result) == ["song_a", "song_b"]
+    assert sensor.state["known_dirs"] == ["song_a", "song_b"]
+    assert sensor.state["watch_dir_mtime_ns"] == os.stat(watch_dir).st_mtime_ns
+    assert sensor.state["last_activity_ns"] == clock.now_ns
+
+
+def test_unchanged_watch_dir_skips_without_scanning(watch_dir, clock, dir_proc):
+    _mkdirs(watch_dir, clock, "song_a")
+    sensor = Sensor(dir_proc)
+    sensor.tick()
+    dir_proc.reset_mock()
+
+    clock.advance(2)
+    with mock.patch.object(sensors, "_scan_watch_dir") as scan:
+        result = sensor.tick()
+
+    assert result.skip_message == "Watched folder unchanged since last check"
+    assert not sensor.cursor_updated
+    scan.assert_not_called()
+    dir_proc.find_unprocessed_directories.assert_not_called()
+
+
+def test_new_directory_is_the_only_candidate(watch_dir, clock, dir_proc):
+    _mkdirs(watch_dir, clock, "song_a")
+    sensor = Sensor(dir_proc)
+    sensor.tick()
+    dir_proc.reset_mock()
+
+    _mkdirs(watch_dir, clock, "song_b")
+    result = sensor.tick()
+
+    assert _dirnames(result) == ["song_b"]
+    assert list(dir_proc.find_unprocessed_directories.call_args.args[0]) == ["song_b"]
+    assert sensor.state["known_dirs"] == ["song_a", "song_b"]
+
+
+def test_known_directories_skip_the_database(watch_dir, clock, dir_proc):
+    _mkdirs(watch_dir, clock, "song_a")
+    sensor = Sensor(dir_proc)
+    sensor.tick()
+    dir_proc.reset_mock()
+
+    # Changes the mtime without adding a directory
+    (watch_dir / "notes.txt").write_text("not a directory")
+    _mkdirs(watch_dir, clock)
+    result = sensor.tick()
+
+    assert result.skip_message == "No new directories (found 1 existing)"
+    dir_proc.find_unprocessed_directories.assert_not_called()
+
+
+def test_batch_limit_leaves_the_rest_for_the_next_tick(watch_dir, clock, dir_proc, monkeypatch):
+    monkeypatch.setattr(sensors, "_MAX_DIRS_PER_RUN", 2)
+    _mkdirs(watch_dir, clock, "song_a", "song_b", "song_c")
+    sensor = Sensor(dir_proc)
+
+    assert _dirnames(sensor.tick()) == ["song_a", "song_b"]
+    assert sensor.state["watch_dir_mtime_ns"] is None
+
+    clock.advance(2)
+    assert _dirnames(sensor.tick()) == ["song_c"]
+
+
+def test_idle_backoff_and_reset(watch_dir, clock, dir_proc):
+    _mkdirs(watch_dir, clock, "song_a")
+    sensor = Sensor(dir_proc)
+    sensor.tick()
+
+    # Within the first idle minute every tick checks, and unchanged ticks leave the cursor alone
+    clock.advance(30)
+    assert sensor.tick().skip_message == "Watched folder unchanged since last check"
+    assert not sensor.cursor_updated
+
+    # Once idle for a minute, a check runs and is recorded...
+    clock.advance(31)
+    assert sensor.tick().skip_message == "Watched folder unchanged since last check"
+    assert sensor.cursor_updated
+    assert sensor.state["last_check_ns"] == clock.now_ns
+
+    # ...and ticks inside the backoff interval skip before touching the watch dir (a stat of the
+    # missing path would fail) or the cursor
+    clock.advance(2)
+    with mock.patch.object(sensors, "_WATCH_DIR", str(watch_dir / "missing")):
+        assert sensor.tick().skip_message == "Idle for 63s, backing off"
+    assert not sensor.cursor_updated
+
+    # The interval doubles each idle minute, up to the cap
+    assert sensors._idle_check_interval_ns(61 * SECOND_NS) == 4 * SECOND_NS
+    assert sensors._idle_check_interval_ns(150 * SECOND_NS) == 8 * SECOND_NS
+    assert sensors._idle_check_interval_ns(3600 * SECOND_NS) == 30 * SECOND_NS
+
+    # A run resets the backoff, so the next tick checks again
+    clock.advance(2)
+    _mkdirs(watch_dir, clock, "song_b")
+    assert _dirnames(sensor.tick()) == ["song_b"]
+    assert "last_check_ns" not in sensor.state
+    assert sensor.state["last_activity_ns"] == clock.now_ns
+
+    clock.advance(2)
+    assert sensor.tick().skip_message == "Watched folder unchanged since last check"
+
+
+def test_missing_watch_dir_skips(watch_dir, clock, dir_proc, monkeypatch):
+    monkeypatch.setattr(sensors, "_WATCH_DIR", str(watch_dir / "missing"))
+    sensor = Sensor(dir_proc)
+
+    result = sensor.tick()
+
+    assert result.skip_message == f"Directory not found: {watch_dir / 'missing'}"
+    assert not sensor.cursor_updated
+    dir_proc.find_unprocessed_directories.assert_not_called()
+
@@ -0,0 +1,33 @@
+-- Indexes for directory_processing_state / directory_metadata, built CONCURRENTLY so populated tables stay writable.
+-- Runs automatically when the local klangscribe-postgres volume is first initialized (see docker-compose.yml);
+-- apply it by hand, once, to any other database (see README.md):
+--   psql -h <host> -U <user> -d <db> -f local-services/storage/klangscribe-postgres/migrations/001_directory_indexes.sql
+
+-- Same tables DirectoryProcessingResource creates on first use, so this also works on a fresh database
+CREATE TABLE IF NOT EXISTS directory_processing_state (
+    dirname VARCHAR(255) PRIMARY KEY,
+    started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    completed_at TIMESTAMP,
+    status VARCHAR(50) DEFAULT 'processing',
+    run_id VARCHAR(255)
+);
+
+CREATE TABLE IF NOT EXISTS directory_metadata (
+    id SERIAL PRIMARY KEY,
+    dirname VARCHAR(255),
+    file_count INTEGER,
+    total_size BIGINT,
+    files_json JSONB,
+    uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Keyset pagination over metadata, newest first
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_directory_metadata_uploaded_at
+ON directory_metadata(uploaded_at DESC, id DESC);
+
+-- Stuck-directory lookups only ever look at rows still 'processing'
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_directory_processing_state_processing_started_at
+ON directory_processing_state(started_at) WHERE status = 'processing';
+
+-- No query uses this GIN index (created by an earlier schema bootstrap); it only slowed down inserts
+DROP INDEX CONCURRENTLY IF EXISTS idx_directory_metadata_files_json;